@@ -1,11 +1,126 @@
-from google.adk.agents import Agent, ParallelAgent, SequentialAgent, LoopAgent
+from google.adk.agents import Agent, ParallelAgent, SequentialAgent
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.agents.context_cache_config import ContextCacheConfig
 from google.adk.apps.app import App, ResumabilityConfig
+from google.adk.models import LlmRequest, LlmResponse
 from google.adk.models.google_llm import Gemini
 from google.adk.tools import AgentTool, google_search, load_artifacts
+from google.adk.planners import BuiltInPlanner
 from google.adk.plugins.save_files_as_artifacts_plugin import SaveFilesAsArtifactsPlugin
 from google.adk.tools.tool_context import ToolContext
 from google.genai import types
 from pathlib import Path
+from pydantic import BaseModel, Field
+from contextlib import closing
+from typing import AsyncGenerator, Optional
+import asyncio
+import collections
+import functools
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import time
+
+try:
+    import orjson
+except ImportError:  # Optional speed-up for the JSON passed between agents; stdlib json is the fallback
+    orjson = None
+
+GENERATED_RESUME_FILENAME = "generated_resume_latex.tex"
+
+def _json_loads(text: str):
+    """Parses JSON with orjson when it is installed."""
+    return orjson.loads(text) if orjson is not None else json.loads(text)
+
+def _json_dumps(data) -> str:
+    """Serializes JSON without whitespace, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(data).decode("utf-8")
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+# --- Structured Output Schemas ---
+class ContactInfo(BaseModel):
+    email: Optional[str] = None
+    phone: Optional[str] = None
+    linkedin: Optional[str] = None
+    github: Optional[str] = Field(default=None, description="Only if relevant.")
+    portfolio: Optional[str] = Field(default=None, description="Only if relevant.")
+
+class Education(BaseModel):
+    institution: str
+    degree: Optional[str] = None
+    location: Optional[str] = Field(default=None, description="City, state/country.")
+    start_date: Optional[str] = Field(default=None, description="YYYY-MM")
+    end_date: Optional[str] = Field(default=None, description="YYYY-MM")
+    gpa: Optional[str] = Field(default=None, description="GPA or percentage.")
+
+class Experience(BaseModel):
+    company: str
+    title: str
+    location: Optional[str] = None
+    start_date: Optional[str] = Field(default=None, description="YYYY-MM")
+    end_date: Optional[str] = Field(default=None, description="YYYY-MM or 'Present'.")
+    description: Optional[str] = None
+    impact_bullets: list[str] = []
+
+class Project(BaseModel):
+    name: str
+    description: Optional[str] = None
+    technologies: list[str] = []
+    link: Optional[str] = Field(default=None, description="Must be included if present in the resume.")
+    impact_bullets: list[str] = []
+
+class SkillCategory(BaseModel):
+    category: str = Field(description="e.g. 'Languages', 'Frameworks', 'Tools'.")
+    skills: list[str]
+
+class Skills(BaseModel):
+    hard_skills: list[SkillCategory] = []
+    soft_skills: list[str] = []
+
+class Certification(BaseModel):
+    name: str
+    issuer: Optional[str] = None
+    date: Optional[str] = None
+
+class Achievement(BaseModel):
+    title: str
+    description: Optional[str] = None
+
+class Language(BaseModel):
+    language: str
+    proficiency: Optional[str] = None
+
+class ResumeStructured(BaseModel):
+    """Schema of 'resume_structured', as extracted by ResumeParserAgent."""
+    full_name: str
+    contact_info: ContactInfo
+    education: list[Education] = []
+    experience: list[Experience] = []
+    projects: list[Project] = []
+    skills: Skills
+    certifications: list[Certification] = []
+    achievements: list[Achievement] = []
+    languages: list[Language] = []
+
+class OptimizedResumeResult(BaseModel):
+    """Schema of ResumeOptimizerAgent's self-refined response."""
+    final_resume: ResumeStructured
+    needed_user_info: list[str] = Field(default=[], description="Questions for the user; empty if nothing is needed.")
+
+class JDStructured(BaseModel):
+    """Schema of 'jd_structured', as extracted by JobDescriptionParserAgent."""
+    role_title: str
+    seniority: Optional[str] = None
+    location: Optional[str] = None
+    must_have_skills: list[str] = []
+    nice_to_have_skills: list[str] = []
+    responsibilities: list[str] = []
+    keywords: list[str] = Field(default=[], description="Phrases important for ATS.")
+    screen_out_criteria: list[str] = Field(default=[], description="e.g. 'requires 5+ years'.")
 
 def resume_gap_asker_tool(tool_context: ToolContext) -> dict:
     """
@@ -17,6 +132,14 @@ def resume_gap_asker_tool(tool_context: ToolContext) -> dict:
         dict: A dictionary indicating the status and user input.
     """
     critique = tool_context.state.get("critique", "")
+
+    # Nothing to ask when the critique approved the resume (or there is no critique)
+    if not critique.strip() or critique.strip().upper() == "APPROVED":
+        return {
+            "status": "approved",
+            "user_input": "",
+            "message": "No additional info needed."
+        }
     
     tool_confirmation = tool_context.tool_confirmation
     
@@ -60,50 +183,471 @@ def resume_gap_asker_tool(tool_context: ToolContext) -> dict:
             "message": f"An error occurred: {str(e)}"
         }
 
-def get_latex_template_tool() -> str:
+@functools.lru_cache(maxsize=1)
+def _load_latex_template_bytes() -> bytes:
     """
-    Retrieves the LaTeX resume template from file.
+    Reads the raw bytes of the LaTeX resume template once and caches them for the process lifetime.
+    A single os.read on the descriptor skips the buffered reader and incremental text decoder.
+    The first call happens at import, when ResumeLatexAgent's static instruction is built,
+    so a missing or unreadable resume.tex fails the module import.
     Returns:
-        str: The raw LaTeX template string with placeholders.
+        bytes: The UTF-8 encoded LaTeX template.
     """
+    template_path = Path(__file__).parent / "resume.tex"
     try:
-        template_path = Path(__file__).parent / "resume.tex"
-        
-        with open(template_path, 'r', encoding='utf-8') as f:
-            latex_content = f.read()
-        
-        return latex_content
-    
+        fd = os.open(template_path, os.O_RDONLY)
+        try:
+            return os.read(fd, os.fstat(fd).st_size)
+        finally:
+            os.close(fd)
     except FileNotFoundError:
         raise FileNotFoundError(f"LaTeX template not found at: {template_path}")
     except Exception as e:
         raise Exception(f"Error reading LaTeX template: {str(e)}")
 
-async def save_generated_resume_latex(tool_context: ToolContext, latex_content: str):
-    """Saves generated latex content as an artifact."""
+def _load_latex_template() -> str:
+    """
+    Decodes the cached LaTeX resume template.
+    Returns:
+        str: The raw LaTeX template string with placeholders.
+    """
+    return _load_latex_template_bytes().decode('utf-8')
+
+# --- Resume Validation ---
+ATS_MIN_WORDS = 350
+ATS_MAX_WORDS = 450
+ATS_REQUIRED_SECTIONS = ("education", "experience", "skills")
+
+def _strip_code_fence(text: str) -> str:
+    """Removes a surrounding markdown code fence (e.g. ```json or ```latex) from model output."""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0]
+    return text.strip()
+
+def _parse_json_state(value) -> Optional[dict]:
+    """
+    Parses a JSON object stored in state by an agent, tolerating markdown code fences.
+    Returns:
+        Optional[dict]: The parsed object, or None if the value is not a JSON object.
+    """
+    if isinstance(value, dict):
+        return value
+    if not isinstance(value, str):
+        return None
+
+    try:
+        data = _json_loads(_strip_code_fence(value))
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+def _strip_empty(value):
+    """Recursively drops null values, blank strings and empty lists/objects from parsed JSON."""
+    if isinstance(value, dict):
+        value = {key: _strip_empty(item) for key, item in value.items()}
+        return {key: item for key, item in value.items() if item not in (None, "", [], {})}
+    if isinstance(value, list):
+        value = [_strip_empty(item) for item in value]
+        return [item for item in value if item not in (None, "", [], {})]
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+def _compact_json(data) -> str:
+    """Serializes JSON for prompts with empty fields removed and no whitespace between tokens."""
+    return _json_dumps(_strip_empty(data))
+
+def _flatten_text(value) -> list:
+    """Collects every string nested inside a parsed JSON value."""
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        return [text for item in value for text in _flatten_text(item)]
+    return []
+
+def _meets_resume_rules(resume: dict) -> bool:
+    """Checks that a parsed resume has every mandatory section and fits the single-page word range."""
+    if any(not resume.get(section) for section in ATS_REQUIRED_SECTIONS):
+        return False
+    return ATS_MIN_WORDS <= len(" ".join(_flatten_text(resume)).split()) <= ATS_MAX_WORDS
+
+def validate_resume(state) -> bool:
+    """
+    Validates state['optimized_resume'] against the mandatory sections and word count.
+    Args:
+        state: The session state.
+    Returns:
+        bool: True if the resume passes, False if it is missing, unparseable or breaks a rule.
+    """
+    resume = _parse_json_state(state.get("optimized_resume"))
+    return resume is not None and _meets_resume_rules(resume)
+
+def split_optimizer_result_callback(callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
+    """
+    Splits the self-refined optimizer response into state.
+    The final resume is written to state['optimized_resume']. Any information still needed
+    from the user becomes state['critique'], which is "APPROVED" when nothing is needed.
+    A stale user_input from an earlier run is cleared.
+    """
+    if llm_response.partial or not llm_response.content or not llm_response.content.parts:
+        return None
+
+    text = "".join(part.text or "" for part in llm_response.content.parts if not part.thought)
+    data = _parse_json_state(text)
+    final_resume = data.get("final_resume") if data else None
+    if not isinstance(final_resume, dict):
+        # Keep the raw response so downstream agents still have a resume to work with; with
+        # no gaps to ask about, the refine pass runs only if the resume fails validation
+        callback_context.state["optimized_resume"] = text
+        callback_context.state["critique"] = ""
+        callback_context.state["user_input"] = ""
+        return None
+
+    callback_context.state["optimized_resume"] = _compact_json(final_resume)
+    callback_context.state["user_input"] = ""
+
+    needed_user_info = _flatten_text(data.get("needed_user_info", []))
+    if not needed_user_info:
+        callback_context.state["critique"] = "APPROVED"
+    else:
+        callback_context.state["critique"] = "\n".join(f"- {item}" for item in needed_user_info)
+    return None
+
+def compact_resume_callback(callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
+    """
+    Stores the refined resume in state['optimized_resume'], minified so ResumeLatexAgent
+    receives fewer input tokens and no empty sections.
+    The agent has no output_key: ADK would also store a skip message from its
+    before_agent_callback there, replacing the resume the skip meant to keep.
+    """
+    if llm_response.partial or not llm_response.content or not llm_response.content.parts:
+        return None
+
+    text = "".join(part.text or "" for part in llm_response.content.parts if not part.thought)
+    if not text.strip():
+        return None
+    resume = _parse_json_state(text)
+    if resume is None:
+        # Keep the raw response so ResumeLatexAgent still has a resume to work with
+        callback_context.state["optimized_resume"] = text
+        return None
+
+    compact_resume = _compact_json(resume)
+    callback_context.state["optimized_resume"] = compact_resume
+    return llm_response.model_copy(update={
+        "content": types.Content(role="model", parts=[types.Part(text=compact_resume)])
+    })
+
+def store_output_as_json_callback(output_key: str):
+    """
+    Builds an after_agent_callback that re-serializes an output_schema result as compact JSON.
+    ADK stores schema output in state as a dict, which `{key}` instruction placeholders would
+    otherwise inject as its Python repr.
+    """
+    def callback(callback_context: CallbackContext) -> Optional[types.Content]:
+        value = callback_context.state.get(output_key)
+        if isinstance(value, dict):
+            callback_context.state[output_key] = _compact_json(value)
+        return None
+    return callback
+
+def skip_when_approved_callback(callback_context: CallbackContext) -> Optional[types.Content]:
+    """
+    Skips the agent when there is nothing left to ask or refine,
+    i.e. the critique is empty or exactly "APPROVED".
+    """
+    critique = callback_context.state.get("critique", "")
+    if isinstance(critique, str) and critique.strip().upper() not in ("", "APPROVED"):
+        return None
+
+    return types.Content(
+        role="model",
+        parts=[types.Part(text=f"Critique approved, skipping {callback_context.agent_name}.")]
+    )
+
+def skip_unless_refine_needed_callback(callback_context: CallbackContext) -> Optional[types.Content]:
+    """
+    Skips the single refine pass unless it has work to do: the user answered the gap
+    questions (and did not type 'SKIP'), or the resume fails `validate_resume`.
+    """
+    if skip_when_approved_callback(callback_context) is None:
+        user_input = callback_context.state.get("user_input", "")
+        if isinstance(user_input, str) and user_input.strip() and user_input.strip().upper() != "SKIP":
+            return None
+
+    if not validate_resume(callback_context.state):
+        return None
+
+    return types.Content(
+        role="model",
+        parts=[types.Part(text=f"Resume is valid and no user information was added, skipping {callback_context.agent_name}.")]
+    )
+
+# --- Near-duplicate Resume Cache ---
+RESUME_CACHE_PATH = Path(os.environ.get("RESUME_CACHE_PATH", Path(__file__).parent / ".resume_cache.sqlite3"))
+RESUME_CACHE_MAX_ENTRIES = 256
+RESUME_CACHE_MIN_SIMILARITY = 0.95
+RESUME_CACHE_MIN_SHINGLES = 50
+MINHASH_PERMUTATIONS = 128
+MINHASH_SHINGLE_SIZE = 3
+_MINHASH_PRIME = (1 << 61) - 1
+_minhash_rng = random.Random(42)  # fixed seed keeps signatures comparable across restarts
+_MINHASH_PARAMS = [
+    (_minhash_rng.randrange(1, _MINHASH_PRIME), _minhash_rng.randrange(0, _MINHASH_PRIME))
+    for _ in range(MINHASH_PERMUTATIONS)
+]
+
+def _minhash_signature(text: str) -> Optional[list]:
+    """
+    Computes a MinHash signature over word shingles of the normalized text.
+    Returns:
+        Optional[list]: The signature, or None if the text is too short to compare reliably.
+    """
+    words = re.findall(r"\w+", text.lower())
+    shingles = {
+        " ".join(words[i:i + MINHASH_SHINGLE_SIZE])
+        for i in range(len(words) - MINHASH_SHINGLE_SIZE + 1)
+    }
+    if len(shingles) < RESUME_CACHE_MIN_SHINGLES:
+        return None
+
+    hashes = [
+        int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for shingle in shingles
+    ]
+    return [min((a * h + b) % _MINHASH_PRIME for h in hashes) for a, b in _MINHASH_PARAMS]
+
+def _session_user_text(tool_context: ToolContext) -> str:
+    """Joins the text of every user message in the session (resume, job description, company)."""
+    return "\n".join(
+        part.text
+        for event in tool_context.session.events
+        if event.author == "user" and event.content and event.content.parts
+        for part in event.content.parts
+        if part.text
+    )
 
-    # Convert the string content back into bytes for artifact handling
-    latex_bytes = latex_content.encode('utf-8')
+_CONTACT_PATTERNS = (
+    re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+"),                                   # emails
+    re.compile(r"(?:https?://|www\.|(?:linkedin|github)\.com/)[^\s,;)\]]+"),        # profile/portfolio URLs
+    re.compile(r"\+?\d[\d\s().-]{7,}\d"),                                           # phone numbers
+)
+
+def _resume_cache_scope(tool_context: ToolContext, text: str) -> str:
+    """
+    Hashes the user id together with every email, URL and phone number in the inputs.
+    Cached resumes are only served within the same scope, so a near-duplicate resume never
+    returns another user's resume, nor an old resume after the contact details were edited.
+    """
+    contacts = sorted({
+        re.sub(r"[\s().-]", "", match.lower()) for pattern in _CONTACT_PATTERNS for match in pattern.findall(text)
+    })
+    scope = "\n".join([tool_context.session.user_id, *contacts])
+    return hashlib.blake2b(scope.encode("utf-8"), digest_size=16).hexdigest()
+
+async def _has_uploaded_files(tool_context: ToolContext) -> bool:
+    """
+    Checks whether the user uploaded any file in this session. Uploads are only
+    referenced by a placeholder in the session text, so they never reach the signature.
+    """
+    if any(
+        part.inline_data or part.file_data
+        for event in tool_context.session.events
+        if event.author == "user" and event.content and event.content.parts
+        for part in event.content.parts
+    ):
+        return True
+    filenames = await tool_context.list_artifacts()
+    return any(filename != GENERATED_RESUME_FILENAME for filename in filenames)
+
+def _open_resume_cache() -> sqlite3.Connection:
+    """Opens the on-disk cache mapping scoped input signatures to generated LaTeX resumes."""
+    connection = sqlite3.connect(RESUME_CACHE_PATH)
+    with connection:
+        # The unscoped table from earlier versions could serve one user's resume to another
+        connection.execute("DROP TABLE IF EXISTS resume_cache")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS scoped_resume_cache ("
+            "scope TEXT NOT NULL, signature TEXT NOT NULL, latex TEXT NOT NULL, last_used REAL NOT NULL, "
+            "PRIMARY KEY (scope, signature))"
+        )
+    return connection
+
+def lookup_cached_resume(scope: str, signature: list) -> Optional[str]:
+    """
+    Finds a previously generated LaTeX resume in the same scope (see `_resume_cache_scope`)
+    whose inputs are a near-duplicate of the signature.
+    Returns:
+        Optional[str]: The cached LaTeX if the estimated Jaccard similarity is at least
+        RESUME_CACHE_MIN_SIMILARITY, otherwise None.
+    """
+    with closing(_open_resume_cache()) as connection, connection:
+        rows = connection.execute(
+            "SELECT signature, latex FROM scoped_resume_cache WHERE scope = ?", (scope,)
+        ).fetchall()
+        for key, latex in rows:
+            cached = _json_loads(key)
+            similarity = sum(x == y for x, y in zip(signature, cached)) / MINHASH_PERMUTATIONS
+            if similarity >= RESUME_CACHE_MIN_SIMILARITY:
+                connection.execute(
+                    "UPDATE scoped_resume_cache SET last_used = ? WHERE scope = ? AND signature = ?",
+                    (time.time(), scope, key),
+                )
+                return latex
+    return None
+
+def store_cached_resume(scope: str, signature: list, latex_content: str) -> None:
+    """Stores a generated LaTeX resume, evicting the least recently used entries beyond the cache size."""
+    with closing(_open_resume_cache()) as connection, connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO scoped_resume_cache (scope, signature, latex, last_used) VALUES (?, ?, ?, ?)",
+            (scope, _json_dumps(signature), latex_content, time.time()),
+        )
+        connection.execute(
+            "DELETE FROM scoped_resume_cache WHERE rowid NOT IN ("
+            "SELECT rowid FROM scoped_resume_cache ORDER BY last_used DESC LIMIT ?)",
+            (RESUME_CACHE_MAX_ENTRIES,),
+        )
 
+async def _save_latex_artifact(context: CallbackContext, latex_content: str) -> int:
+    """
+    Saves LaTeX content as the generated resume artifact.
+    Returns:
+        int: The version of the saved artifact.
+    """
+    # Encode straight into the Blob so no extra name keeps the bytes buffer alive
     artifact_part = types.Part(
         inline_data=types.Blob(
             mime_type="text/plain",
-            data=latex_bytes
+            data=latex_content.encode('utf-8', errors='strict')
         )
     )
-    filename = "generated_resume_latex.tex"
+    return await context.save_artifact(filename=GENERATED_RESUME_FILENAME, artifact=artifact_part)
+
+async def resume_cache_lookup_callback(tool, args: dict, tool_context: ToolContext) -> Optional[dict]:
+    """
+    Serves a cached resume in place of `ResumeSequence` when the session inputs nearly match
+    a previous run of the same user with the same contact details. The lookup is skipped once this session has generated a resume, so
+    follow-up requests are not answered from the cache, and whenever files were uploaded,
+    since their contents are not part of the signature.
+    On a hit the cached LaTeX is saved as the artifact and returned as the tool result;
+    otherwise the scope and signature are kept in state so the result can be cached once it is saved.
+    """
+    if tool.name != resume_sequence.name or tool_context.state.get("resume_generated"):
+        return None
 
     try:
-        version = await tool_context.save_artifact(filename=filename, artifact=artifact_part)
-        return {
+        if await _has_uploaded_files(tool_context):
+            return None
+    except ValueError as e:
+        print(f"Error listing artifacts: {e}. Is ArtifactService configured in Runner?")
+        return None
+
+    text = _session_user_text(tool_context)
+    signature = _minhash_signature(text)
+    if signature is None:
+        return None
+    scope = _resume_cache_scope(tool_context, text)
+    tool_context.state["resume_cache_scope"] = scope
+    tool_context.state["resume_cache_signature"] = signature
+
+    try:
+        latex_content = await asyncio.to_thread(lookup_cached_resume, scope, signature)
+    except sqlite3.Error as e:
+        print(f"Error reading resume cache: {e}")
+        return None
+    if latex_content is None:
+        return None
+
+    try:
+        version = await _save_latex_artifact(tool_context, latex_content)
+    except Exception as e:
+        print(f"An unexpected error occurred while saving the cached resume: {e}")
+        return None
+    tool_context.state["resume_generated"] = True
+
+    return {
         "status": "success",
-        "message": f"File '{filename}' (version {version}) has been created and is now available for download.",
-        # The ADK UI will automatically intercept this response and provide a download link.
+        "message": (
+            f"SAVED: These inputs match a resume that was already optimized, so it was reused. "
+            f"File '{GENERATED_RESUME_FILENAME}' (version {version}) has been created "
+            "and is now available for download."
+        ),
     }
+
+async def _cache_generated_resume(context: CallbackContext, latex_content: str) -> None:
+    """
+    Marks the session as having generated a resume, and caches the resume under the input
+    scope and signature computed by `resume_cache_lookup_callback`, if any.
+    """
+    context.state["resume_generated"] = True
+    scope = context.state.get("resume_cache_scope")
+    signature = context.state.get("resume_cache_signature")
+    if not scope or not signature:
+        return
+    try:
+        await asyncio.to_thread(store_cached_resume, scope, signature, latex_content)
+    except sqlite3.Error as e:
+        print(f"Error writing resume cache: {e}")
+
+async def save_latex_on_done_callback(callback_context: CallbackContext) -> Optional[types.Content]:
+    """
+    Saves the filled LaTeX template as soon as ResumeLatexAgent finishes, instead of
+    waiting for the root agent to relay it to `save_generated_resume_latex`.
+    On success a short confirmation replaces the LaTeX as the sequence result; on failure
+    the LaTeX is left as the result so the root agent can still save it with the tool.
+    """
+    latex_content = callback_context.state.get("filled_LaTeX_TEMPLATE")
+    if not isinstance(latex_content, str) or not latex_content.strip():
+        return None
+    latex_content = _strip_code_fence(latex_content)
+
+    try:
+        version = await _save_latex_artifact(callback_context, latex_content)
+    except Exception as e:
+        print(f"An unexpected error occurred during LaTeX artifact save: {e}")
+        return None
+    await _cache_generated_resume(callback_context, latex_content)
+
+    return types.Content(
+        role="model",
+        parts=[types.Part(text=(
+            f"SAVED: File '{GENERATED_RESUME_FILENAME}' (version {version}) has been created "
+            "and is now available for download."
+        ))]
+    )
+
+async def save_generated_resume_latex(tool_context: ToolContext, latex_content: str):
+    """Saves generated latex content as an artifact."""
+
+    filename = GENERATED_RESUME_FILENAME
+
+    try:
+        version = await _save_latex_artifact(tool_context, latex_content)
     except ValueError as e:
         print(f"Error saving LaTeX artifact: {e}. Is ArtifactService configured in Runner?")
+        return {"status": "error", "message": f"The resume could not be saved: {str(e)}"}
     except Exception as e:
         print(f"An unexpected error occurred during LaTeX artifact save: {e}")
+        return {"status": "error", "message": f"The resume could not be saved: {str(e)}"}
+    await _cache_generated_resume(tool_context, latex_content)
+
+    return {
+        "status": "success",
+        "message": f"File '{filename}' (version {version}) has been created and is now available for download.",
+        # The ADK UI will automatically intercept this response and provide a download link.
+    }
+
+def _static_instruction(*texts: str) -> types.Content:
+    """
+    Builds a static instruction, which ADK sends verbatim (no state injection) ahead of the
+    dynamic instruction so the App's context cache can reuse it across calls.
+    """
+    return types.Content(role="user", parts=[types.Part(text=text) for text in texts])
 
 # --- Configuration ---
 retry_config = types.HttpRetryOptions(
@@ -113,59 +657,125 @@ retry_config = types.HttpRetryOptions(
 )
 
 
-model_standard = Gemini(model="gemini-2.5-flash", retry_options=retry_config)
-model_lite = Gemini(model="gemini-2.5-flash-lite", retry_options=retry_config)
+# --- Rate Limiting ---
+# Paces Gemini calls locally so requests wait for quota instead of paying a round-trip
+# for a 429 and the retry backoff. Free-tier keys allow 60 requests per minute by default.
+GEMINI_RPM = int(os.environ.get("GEMINI_RPM", "60"))
+GEMINI_MAX_INFLIGHT = int(os.environ.get("GEMINI_MAX_INFLIGHT", "4"))
+
+class RequestRateLimiter:
+    """Allows at most `max_rate` acquisitions in any sliding window of `time_period` seconds."""
+
+    def __init__(self, max_rate: int, time_period: float = 60):
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self._timestamps = collections.deque()
+        # Created on first use, so it binds to the running event loop rather than the import-time one
+        self._lock = None
+
+    async def acquire(self) -> None:
+        """Waits until a request can be sent without exceeding the rate."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._timestamps and now - self._timestamps[0] >= self.time_period:
+                    self._timestamps.popleft()
+                if len(self._timestamps) < self.max_rate:
+                    self._timestamps.append(now)
+                    return
+                await asyncio.sleep(self.time_period - (now - self._timestamps[0]))
+
+gemini_rate_limiter = RequestRateLimiter(GEMINI_RPM, 60)
+_gemini_inflight = None
+
+def _gemini_inflight_semaphore() -> asyncio.Semaphore:
+    """Returns the process-wide in-flight bound, creating it on first use inside the running event loop."""
+    global _gemini_inflight
+    if _gemini_inflight is None:
+        _gemini_inflight = asyncio.Semaphore(GEMINI_MAX_INFLIGHT)
+    return _gemini_inflight
+
+class RateLimitedGemini(Gemini):
+    """Gemini model whose requests share the process-wide rate limiter and in-flight bound."""
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        # The slot is held only while each response is fetched, never across a yield: ADK runs
+        # the response's tool calls (including AgentTool sub-agents) while this generator is
+        # suspended, so holding the slot there would starve or deadlock them. Fetching chunk
+        # by chunk also keeps SSE streaming incremental.
+        await gemini_rate_limiter.acquire()
+        llm_responses = super().generate_content_async(llm_request, stream).__aiter__()
+        try:
+            while True:
+                async with _gemini_inflight_semaphore():
+                    try:
+                        llm_response = await llm_responses.__anext__()
+                    except StopAsyncIteration:
+                        return
+                yield llm_response
+        finally:
+            await llm_responses.aclose()
+
+model_standard = RateLimitedGemini(model="gemini-2.5-flash", retry_options=retry_config)
+model_lite = RateLimitedGemini(model="gemini-2.5-flash-lite", retry_options=retry_config)
+
+# Each DataParserAgent branch gets its own Gemini instance, and so its own
+# google.genai client and connection pool, keeping the ParallelAgent's
+# concurrent generateContent calls from contending on one shared client.
+# The parsers only do mechanical JSON extraction, which the lite model handles at a lower latency.
+model_resume_parser = RateLimitedGemini(model="gemini-2.5-flash-lite", retry_options=retry_config)
+model_jd_parser = RateLimitedGemini(model="gemini-2.5-flash-lite", retry_options=retry_config)
+model_company_researcher = RateLimitedGemini(model="gemini-2.5-flash", retry_options=retry_config)
+
+# Output tokens dominate latency, so every agent caps its output and thinking budget.
+# Thinking tokens count towards max_output_tokens on 2.5 models, so the caps leave room for them.
+# Mechanical extraction gains nothing from thinking; generation steps keep a small budget.
+no_thinking_planner = BuiltInPlanner(thinking_config=types.ThinkingConfig(thinking_budget=0))
+low_thinking_planner = BuiltInPlanner(thinking_config=types.ThinkingConfig(thinking_budget=1024))
 
 # 1. RESUME PARSER 
 resume_parser_agent = Agent(
     name="ResumeParserAgent",
-    model=model_standard, 
-    instruction="""You are a resume parsing specialist. Extract the user’s resume into a clean JSON structure without changing facts.
+    model=model_resume_parser, 
+    static_instruction=_static_instruction("""You are a resume parsing specialist. Extract the user’s resume into the response schema without changing facts.
 
     Inputs: Resume content.
 
-    Output: A JSON with the following fields:
-    - full_name
-    - contact_info: {email, phone, linkedin, github(if relevant), portfolio(if relevant)}
-    - education[]: {institution, degree, {city, state/country}, start_date(YYYY-MM), end_date(YYYY-MM), gpa(or percentage)}
-    - experience[]: {company, title, location, start_date, end_date, description}
-    - projects[]: {name, description, technologies{}, link(must if relevant), impact_bullets[]}
-    - skills[]: {hard_skills, soft_skills} list of skills (divide into categories of object{} if possible)
-    - certifications[]: {name, issuer, date}list of certifications
-    - achievements[]: {title, description{}}list of achievements
-    - languages[]: list of languages with proficiency levels
-    Output ONLY the structured JSON to the state with the key 'resume_structured'.
-""",
-    output_key="resume_structured" 
+    Leave out any field the resume does not contain, and group hard skills into categories where possible.
+"""),
+    output_schema=ResumeStructured,
+    # The whole resume is re-emitted as JSON, and a truncated response fails output_schema
+    # validation and aborts the run, so this cap leaves room for long resumes.
+    generate_content_config=types.GenerateContentConfig(max_output_tokens=4096),
+    planner=no_thinking_planner,
+    output_key="resume_structured",
+    after_agent_callback=store_output_as_json_callback("resume_structured"),
 )
 
 # 2. JOB DESCRIPTION PARSER
 job_description_parser_agent = Agent(
     name="JobDescriptionParserAgent",
-    model=model_standard, 
-    instruction="""You are a job description analysis expert. Convert the given job description into a requirements map.
+    model=model_jd_parser, 
+    static_instruction=_static_instruction("""You are a job description analysis expert. Convert the given job description into a requirements map matching the response schema.
 
 	Inputs: Look for the job description text in the user's chat first; if not found, call the `load_artifacts` tool to retrieve an uploaded job description file.
-    Description file from calling `load_artifacts` tool.
-	Output: JSON with:
-	role_title, seniority, location,
-	must_have_skills[],
-	nice_to_have_skills[],
-	responsibilities[],
-	keywords[] (phrases important for ATS),
-	screen_out_criteria[] (e.g. ‘requires 5+ years’).
 	Do not copy long sentences; keep items short and specific.
-	Output ONLY the structured JSON to the session context with the key 'jd_structured'.
-    """,
+    """),
+    output_schema=JDStructured,
+    generate_content_config=types.GenerateContentConfig(max_output_tokens=2048),
+    planner=no_thinking_planner,
     output_key="jd_structured",
     tools=[load_artifacts],
+    after_agent_callback=store_output_as_json_callback("jd_structured"),
 )
 
 # 3. COMPANY RESEARCHER 
 company_researcher_agent = Agent(
     name="ResearcherAgent",
-    model=model_standard,
-    instruction="""You are a Company and Job Profile Analyst.
+    model=model_company_researcher,
+    static_instruction=_static_instruction("""You are a Company and Job Profile Analyst.
 
     Inputs:
     - `company_name`: The name of the company to research.
@@ -175,31 +785,34 @@ company_researcher_agent = Agent(
 
     Steps:
     1.  Company Research:
-        - Use the `google_search` tool to find information about the company's:
-            - Mission, values, and culture (e.g., search for "company_name company culture", "company_name mission and values").
-            - Recent news or significant events (e.g., search for "company_name recent news").
-            - Products, services, and core business.
+        - Use the `google_search` tool ONCE, issuing all of these queries together in that single search step
+          (do not search again after seeing the results):
+            - Mission, values, and culture (e.g., "company_name company culture", "company_name mission and values").
+            - Recent news or significant events (e.g., "company_name recent news").
+            - Products, services, and core business (e.g., "company_name products and services").
         - Synthesize these findings into a "company_overview" section.
 
     Output:
     - A JSON object assigned to the `job_profile` key with the following structure:
-    {{
-        "company_overview": {{
+    {
+        "company_overview": {
             "mission": "...",
             "values": ["...", "..."],
             "culture_summary": "...",
             "recent_news_summary": "..."
-        }},
-        "role_alignment": {{
+        },
+        "role_alignment": {
             "top_3_priorities": ["...", "...", "..."],
             "critical_skills": ["...", "..."],
             "ideal_candidate_profile": "..."
-        }}
-    }}
+        }
+    }
     - The "ideal_candidate_profile" should be a 2-3 sentence summary of the perfect candidate, blending skills with company culture.
     - Keep all summaries concise and focused on what a job applicant needs to know.
-    """,
+    """),
     tools=[google_search],
+    generate_content_config=types.GenerateContentConfig(max_output_tokens=4096),
+    planner=low_thinking_planner,
     output_key="job_profile"
 )
 
@@ -209,102 +822,125 @@ data_parser = ParallelAgent(
     sub_agents=[resume_parser_agent, job_description_parser_agent, company_researcher_agent], 
 )
 
-#5. INITIAL RESUME OPTIMIZATION
-initial_resume_optimization_agent = Agent(
-    name="InitialResumeOptimizationAgent",
-    model=model_standard,
-    instruction="""You are a concise resume optimizer. Your goal is to generate an initial optimized resume draft that will fit on a single page.
-
-    Inputs: {resume_structured} (your resume data), {jd_structured} (job requirements), and {job_profile} (company insights).
-    Output: An optimized JSON resume, highlighting alignment with the job description and company culture.
-    
-    Important:
-    - The output resume must remain factual; do not invent new experiences or skills or projects.
-    - Only rephrase and reorganize existing information to better match the job description.
-    - Make sure the json structure remains consistent with the original resume format.
-
-    Content Rules:
+# Content rules shared by every step that writes resume content, including the batch pipeline
+RESUME_CONTENT_RULES = """Content Rules:
     -No Summary or Objective sections.
     - Select the AT MOST 3 relevant projects and 3 relevant experiences from the user's resume based on the job description.
     - each description of project or experience should concise, short and NOT MORE THAN 2 sentences.
     - The sentence should be CONCISE, achievement-oriented, quantifying impact where possible.
     - Words MUST be between 350-450 words to ensure ATS compatibility and to FIT IN A SINGLE PAGE.
+    """
 
-    Output ONLY the optimized resume JSON to the session context with the key 'optimized_resume'.
-    """,
-    output_key="optimized_resume",
-)
+#5. RESUME OPTIMIZER
+# Drafting, ATS self-review and refinement happen within a single structured generation; the
+# after_model_callback stores the final resume and turns any remaining gaps into the critique.
+resume_optimizer_agent = Agent(
+    name="ResumeOptimizerAgent",
+    model=model_standard,
+    static_instruction=_static_instruction("""You are a concise resume optimizer and ATS compatibility reviewer. Your goal is to generate an optimized resume that will fit on a single page.
 
-#6. CRITIQUE AGENT
-critique_agent = Agent(
-    name="CritiqueAgent",
-    model=model_lite,
-    instruction="""You are a constructive resume critique and ATS compatibility reviewer.
-    Inputs:
-        - Resume: {optimized_resume}
-        - Job Description: {jd_structured}
-        - Company Insights: {job_profile}
+    Inputs: 'resume_structured' (your resume data), 'jd_structured' (job requirements), and 'job_profile' (company insights), provided in the request.
 
-    Tasks:
-        1. Evaluate the resume for clarity, relevance, structure, and ATS-friendliness.
-        2. Verify alignment with the job description and company profile.
-        3. If the resume is well-written and fully compatible, respond ONLY with the exact phrase: "APPROVED"
-        4. Otherwise, provide concise, actionable suggestions for improvement (e.g., add measurable results, include missing required skills, clarify dates/roles).
+    Before answering, work through these steps internally:
+    1. Draft an optimized resume, highlighting alignment with the job description and company culture.
+    2. Review the draft for clarity, relevance, structure, and ATS-friendliness against the job description and company profile.
+    3. Fix everything the review found that can be fixed with the existing information.
+
+    Output:
+    - "final_resume": the refined resume.
+    - "needed_user_info": ONLY the remaining gaps that need more information from the user
+      (e.g., missing required skills, missing measurable results, unclear dates/roles), as short, actionable questions.
+      Leave it empty if nothing more is needed.
 
-    Output only the approval phrase or the suggested improvements as plain text.""",
-    output_key="critique",
+    Important:
+    - The output resume must remain factual; do not invent new experiences or skills or projects.
+    - Only rephrase and reorganize existing information to better match the job description.
+    """, RESUME_CONTENT_RULES),
+    instruction="""resume_structured: {resume_structured}
+    jd_structured: {jd_structured}
+    job_profile: {job_profile}""",
+    output_schema=OptimizedResumeResult,
+    generate_content_config=types.GenerateContentConfig(max_output_tokens=8192),
+    planner=low_thinking_planner,
+    after_model_callback=split_optimizer_result_callback,
 )
 
-#7. RESUME GAP ASKER
+#6. RESUME GAP ASKER
+# No LLM is needed to decide to call one deterministic tool, so the model turns are canned.
+# The tool still runs through ADK's function-call flow, which handles the user confirmation:
+# it pauses for the user's answer and re-runs the tool with it on resume.
+def canned_gap_asker_callback(callback_context: CallbackContext, llm_request: LlmRequest) -> Optional[LlmResponse]:
+    """
+    Replaces both ResumeGapAsker model turns: the first calls `resume_gap_asker_tool`,
+    and once its response is in the request, the tool output is returned as the agent response.
+    """
+    last_content = llm_request.contents[-1] if llm_request.contents else None
+    for part in (last_content.parts or []) if last_content else []:
+        if part.function_response and part.function_response.name == resume_gap_asker_tool.__name__:
+            return LlmResponse(content=types.Content(
+                role="model",
+                parts=[types.Part(text=_json_dumps(part.function_response.response or {}))]
+            ))
+
+    return LlmResponse(content=types.Content(
+        role="model",
+        parts=[types.Part(function_call=types.FunctionCall(name=resume_gap_asker_tool.__name__, args={}))]
+    ))
+
 resume_gap_asker = Agent(
     name="ResumeGapAsker",
     model=model_lite,
-    instruction="""You are helpful questioniare that asks user about resume and job description gap.
-    You have {critique}, and
-    Your task is to Call `resume_gap_asker_tool` tool to get the missing information from the user.
-    And always return the tools output. 
-    """,
+    description="Asks the user for the information the critique found missing.",
+    static_instruction=_static_instruction("""Call the `resume_gap_asker_tool` tool and return its output."""),
     tools=[resume_gap_asker_tool],
-    output_key="user_input",
+    before_agent_callback=skip_when_approved_callback,
+    before_model_callback=canned_gap_asker_callback,
 )
 
-#8. RESUME GAP FILLER
+#7. RESUME GAP FILLER
 resume_gap_filler_agent = Agent(
     name="ResumeGapFillerAgent",
     model=model_standard,
-    instruction="""You are a Resume refiner. You have a resume draft and a critique.
-    Inputs:
-    Resume Draft: {optimized_resume}
-    Critique: {critique}
+    static_instruction=_static_instruction("""You are a Resume refiner. You have a resume draft, the information it was missing, and the user's answers.
+    Inputs: the Resume Draft, the Missing Information and the User Input, provided in the request.
     IMPORTANT:
-    - Maintain factual accuracy; DO NOT invent new experiences, skills, or projects.
-    Your task is to analyze the critique:
-    - IF the critique is EXACTLY "APPROVED", set the status to 'approved' and output the optimized_resume as-is.
-    - OTHERWISE, rewrite the resume draft to fully incorporate the feedback from the critique.
+    - Maintain factual accuracy; DO NOT invent new experiences, skills, or projects beyond what the user provided.
+    Your task is to rewrite the resume draft to fully incorporate the user's answers to the missing information.
+    If there is no User Input, fix the draft so that it follows every Content Rule below.
 
-    Content Rules:
-    -No Summary or Objective sections.
-    - Select the AT MOST 3 relevant projects and 3 relevant experiences from the user's resume based on the job description.
-    - each description of project or experience should concise, short and NOT MORE THAN 2 sentences.
-    - The sentence should be CONCISE, achievement-oriented, quantifying impact where possible.
-    - Words MUST be between 350-450 words to ensure ATS compatibility and to FIT IN A SINGLE PAGE.
-    
     Output the Resume JSON in ALL cases as the agent response.
-""",
-    output_key="optimized_resume",
+""", RESUME_CONTENT_RULES),
+    instruction="""Resume Draft: {optimized_resume}
+    Missing Information: {critique}
+    User Input: {user_input?}""",
+    generate_content_config=types.GenerateContentConfig(max_output_tokens=4096),
+    planner=low_thinking_planner,
+    before_agent_callback=skip_unless_refine_needed_callback,
+    after_model_callback=compact_resume_callback,
 )
 
-# 9. RESUME LATEX AGENT
-resume_latex_agent = Agent(
-    name="ResumeLatexAgent",
-    model=model_standard,
-    instruction="""You are a specialist LaTeX resume generator. Your only job is to populate a LaTeX template with the provided JSON data.
+# 8. RESUME LATEX AGENT
+# The rules and the LaTeX template never change between calls, so they are sent as a
+# static instruction that the App's context cache pins server-side. Only the per-call
+# resume JSON travels in the dynamic instruction. The template is therefore read at import,
+# and a missing resume.tex fails the module import.
+RESUME_LATEX_INSTRUCTION = """You are a specialist LaTeX resume generator. Your only job is to populate a LaTeX template with the provided JSON data.
 
     Inputs:
-            - Resume Data: {optimized_resume}
-            - LaTeX Template: Call the `get_latex_template_tool` to retrieve the raw LaTeX_TEMPLATE"
-    
-    Rules:
+            - Resume Data: provided in the request as 'optimized_resume'.
+            - LaTeX Template: the raw LaTeX_TEMPLATE given at the end of these instructions.
+
+    Tasks:
+        1.  Fill the template using the data from the 'optimized_resume' JSON, following the LaTeX Rules below.
+        2.  For each experience and project, iterate through the 'impact_bullets' array and write a 'resumeItem' for each bullet.
+        3. Ensure all sections (Education, Experience, Projects, Skills, Achievements, Languages) are properly populated at the right section. Empty fields are already stripped from the JSON; remove any template section whose data is absent.
+        4. If any information is not relevant to the section of Latex template, find the best fitting section to include it.
+        5. Ensure all the sections have relevant data in them.
+        8. OUTPUT only the final, 'filled_LaTeX_TEMPLATE'.
+    """
+
+# LaTeX rules shared with the batch pipeline, which fills the same template
+LATEX_TEMPLATE_RULES = """LaTeX Rules:
         1.  You MUST NOT edit, alter, or remove any of the existing LaTeX syntax from the template. Your only task is to replace the placeholder content.
         2.  To ensure the resume fits on a single page, you may remove irrelevant projects or experiences. However, you MUST NOT shorten the descriptions of the items you decide to keep.
         3.  Do not add extra curly braces. The template commands are correct. (Bad: resumeItem{{}{}}, Good: resumeItem{} {}).
@@ -313,31 +949,39 @@ resume_latex_agent = Agent(
         6. DO NOT write any \end commands or document closure commands; the template already includes them.
         7. Use only commands with single \ not double.
         8. Recheck for latex syntax correctness remove errors if any present in the content.
+    """
 
-    Tasks:
-        1.  Fill the template using the data from the 'optimized_resume' JSON.
-        2.  For each experience and project, iterate through the 'impact_bullets' array and write a 'resumeItem' for each bullet.
-        3. Ensure all sections (Education, Experience, Projects, Skills, Achievements, Languages) are properly populated at the right section. Remmove any section that has no data.
-        4. If any information is not relevant to the section of Latex template, find the best fitting section to include it.
-        5. Ensure all the sections have relevant data in them.
-        8. OUTPUT only the final, 'filled_LaTeX_TEMPLATE'.
-    """,
-    tools=[load_artifacts, get_latex_template_tool],
+resume_latex_agent = Agent(
+    name="ResumeLatexAgent",
+    model=model_standard,
+    static_instruction=_static_instruction(
+        RESUME_LATEX_INSTRUCTION,
+        LATEX_TEMPLATE_RULES,
+        f"LaTeX_TEMPLATE:\n{_load_latex_template()}",
+    ),
+    instruction="""Resume Data (optimized_resume): {optimized_resume}""",
+    # The resume arrives through the instruction; the earlier agents' outputs in the
+    # conversation history would only resend it, unminified, along with the parser JSON.
+    include_contents="none",
+    tools=[load_artifacts],
+    generate_content_config=types.GenerateContentConfig(max_output_tokens=8192),
+    planner=low_thinking_planner,
     output_key="filled_LaTeX_TEMPLATE",
+    after_agent_callback=save_latex_on_done_callback,
 )
 
-# 10. RESUME SEQUENCE
+# 9. RESUME SEQUENCE
 resume_sequence = SequentialAgent(
     name="ResumeSequence",
     description="Executes the initial resume optimization process. Requires 'resume', 'job_description', and 'company_name'.",
-    sub_agents=[data_parser, initial_resume_optimization_agent, critique_agent, resume_gap_asker, resume_gap_filler_agent, resume_latex_agent],
+    sub_agents=[data_parser, resume_optimizer_agent, resume_gap_asker, resume_gap_filler_agent, resume_latex_agent],
 )
 
 # 0. ROOT AGENT
 root_agent = Agent(
     name="RootAgent",
     model=model_standard,
-    instruction="""You are a helpful agent.
+    static_instruction=_static_instruction("""You are a helpful agent.
     RULES:
     1. If the user says "Hi" or asks for help, explain that you need:
         - Their Resume (text or file)
@@ -347,16 +991,155 @@ root_agent = Agent(
     3. DO NOT call the `ResumeSequence` tool until you have ALL three pieces of information.
     4. Once you have ALL three pieces, call `load_artifacts` tool to retrieve any uploaded files.
     5. Then call the `ResumeSequence` tool.
-    6. After the sequence completes you will get 'filled_LaTeX_TEMPLATE', call the `save_generated_resume_latex` tool.
-    7. Call the `load_artifacts` tool again to verify the save.
-    8. Confirm to the user that their resume has been successfully generated and saved.
-    9. Tell the user to download the resume and tell them how they can edit there resume or convert it into pdf using online latex editors.
-    """,
+    6. After the sequence completes it saves the resume itself and reports "SAVED". ONLY if you get the raw 'filled_LaTeX_TEMPLATE' instead, call the `save_generated_resume_latex` tool with it.
+    7. Confirm to the user that their resume has been successfully generated and saved.
+    8. Tell the user to download the resume and tell them how they can edit there resume or convert it into pdf using online latex editors.
+    """),
     tools=[AgentTool(resume_sequence), load_artifacts, save_generated_resume_latex],
+    generate_content_config=types.GenerateContentConfig(max_output_tokens=8192),
+    before_tool_callback=resume_cache_lookup_callback,
+)
+
+# 10. BATCH PIPELINE
+# Non-interactive runs can go through the Gemini Batch API at about half the cost, with a
+# turnaround of up to 24 hours. The pipeline stages depend on each other, so a batch job
+# holds one self-contained request that optimizes the resume and fills the LaTeX template.
+BATCH_MODE = os.environ.get("RESUME_BATCH_MODE", "0").lower() in ("1", "true", "yes")
+BATCH_MODEL = "gemini-2.5-flash"
+BATCH_FAILED_STATES = (
+    types.JobState.JOB_STATE_FAILED,
+    types.JobState.JOB_STATE_CANCELLED,
+    types.JobState.JOB_STATE_EXPIRED,
+)
+
+BATCH_PIPELINE_INSTRUCTION = """You are a concise resume optimizer and LaTeX resume generator.
+
+    Inputs: the user's resume, the job description and the company name, provided in the request.
+
+    Steps:
+    1. Extract the job requirements and ATS keywords from the job description, and use what you know about the company's culture.
+    2. Optimize the resume for the job, following the Content Rules below: it must remain factual; do not invent new experiences or skills or projects.
+    3. Fill the LaTeX_TEMPLATE at the end of these instructions with the optimized resume, following the LaTeX Rules below.
+       Write one 'resumeItem' per achievement, put every piece of information in the best fitting section, and remove any template section you have no data for.
+
+    OUTPUT only the final, filled LaTeX document.
+    """
+
+async def submit_batch_pipeline(tool_context: ToolContext, resume: str, job_description: str, company_name: str) -> dict:
+    """
+    Submits the resume optimization as a Gemini Batch API job for non-interactive runs.
+    Args:
+        resume (str): The full text of the user's resume.
+        job_description (str): The full text of the job description.
+        company_name (str): The name of the company.
+    Returns:
+        dict: A dictionary with the status and the batch job name to poll.
+    """
+    request = types.InlinedRequest(
+        contents=[types.Content(role="user", parts=[types.Part(text=(
+            f"Resume:\n{resume}\n\nJob Description:\n{job_description}\n\nCompany Name: {company_name}"
+        ))])],
+        config=types.GenerateContentConfig(
+            system_instruction=[
+                BATCH_PIPELINE_INSTRUCTION,
+                RESUME_CONTENT_RULES,
+                LATEX_TEMPLATE_RULES,
+                f"LaTeX_TEMPLATE:\n{_load_latex_template()}",
+            ],
+            max_output_tokens=8192,
+        ),
+    )
+
+    try:
+        job = await model_standard.api_client.aio.batches.create(
+            model=BATCH_MODEL,
+            src=[request],
+            config=types.CreateBatchJobConfig(display_name=f"resume-{company_name}"[:128]),
+        )
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": f"An error occurred while submitting the batch job: {str(e)}"
+        }
+
+    tool_context.state["batch_job_name"] = job.name
+    return {
+        "status": "submitted",
+        "job_name": job.name,
+        "message": "The batch job was submitted. Results can take up to 24 hours."
+    }
+
+async def get_batch_pipeline_result(tool_context: ToolContext, job_name: str = "") -> dict:
+    """
+    Checks a batch job submitted by `submit_batch_pipeline` and saves the resume once it is done.
+    Args:
+        job_name (str): The batch job name. Defaults to the last job submitted in this session.
+    Returns:
+        dict: A dictionary with the job status, and the saved file once it has succeeded.
+    """
+    job_name = job_name or tool_context.state.get("batch_job_name", "")
+    if not job_name:
+        return {"status": "error", "message": "No batch job has been submitted yet."}
+
+    try:
+        job = await model_standard.api_client.aio.batches.get(name=job_name)
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": f"An error occurred while checking the batch job: {str(e)}"
+        }
+
+    if job.state in BATCH_FAILED_STATES:
+        return {"status": "failed", "job_state": str(job.state)}
+    if job.state != types.JobState.JOB_STATE_SUCCEEDED:
+        return {"status": "pending", "job_state": str(job.state)}
+
+    response = job.dest.inlined_responses[0] if job.dest and job.dest.inlined_responses else None
+    if response is None or response.error or not response.response or not response.response.text:
+        return {"status": "failed", "message": "The batch job finished without a resume."}
+
+    try:
+        version = await _save_latex_artifact(tool_context, _strip_code_fence(response.response.text))
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": f"An error occurred while saving the batch result: {str(e)}"
+        }
+    return {
+        "status": "success",
+        "message": f"File '{GENERATED_RESUME_FILENAME}' (version {version}) has been created and is now available for download.",
+    }
+
+batch_root_agent = Agent(
+    name="BatchRootAgent",
+    model=model_standard,
+    static_instruction=_static_instruction("""You are a helpful agent that generates optimized resumes in the background.
+    RULES:
+    1. If the user says "Hi" or asks for help, explain that you need:
+        - Their Resume (text or file)
+        - The Job Description (text or file)
+        - The Company Name
+       and that results are generated in the background and can take up to 24 hours.
+    2. If user upload any file call `load_artifacts` tool and get the content.
+    3. Once you have ALL three pieces, call the `submit_batch_pipeline` tool with their full text.
+    4. Give the user the returned job name and tell them to come back later to check on it.
+    5. When the user asks about their resume, call the `get_batch_pipeline_result` tool.
+    6. If it succeeded, tell the user to download the resume and how they can edit it or convert it into pdf using online latex editors; otherwise report the status.
+    """),
+    tools=[load_artifacts, submit_batch_pipeline, get_batch_pipeline_result],
+    # Room to relay the full resume and job description text as tool arguments
+    generate_content_config=types.GenerateContentConfig(max_output_tokens=8192),
 )
 
 app = App(
     name="my_agent",
-    root_agent=root_agent,
-    plugins=[SaveFilesAsArtifactsPlugin()] # <--- This handles the upload logic
+    root_agent=batch_root_agent if BATCH_MODE else root_agent,
+    plugins=[SaveFilesAsArtifactsPlugin()], # <--- This handles the upload logic
+    # Caches static instructions (e.g. the LaTeX template) server-side; ADK recreates
+    # the cache once the TTL or the invocation interval is exceeded.
+    context_cache_config=ContextCacheConfig(
+        min_tokens=1024,
+        ttl_seconds=3600,
+        cache_intervals=10,
+    ),
 )
\ No newline at end of file